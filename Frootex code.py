@@ -1,17 +1,43 @@
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 from ortools.constraint_solver import pywrapcp, routing_enums_pb2
+from ortools.util.optional_boolean_pb2 import BOOL_TRUE
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
 
 
 EXCEL_FILE = "orderlist.csv"
-OSRM_URL = "http://localhost:5001/table/v1/driving/"
+OSRM_URL = os.environ.get("OSRM_URL", "http://localhost:5001/table/v1/driving/")
 DEPOT = (77.5946, 12.9716)
 NUM_VEHICLES = 5
 VEHICLE_CAPACITY = 50
 DEMAND_PER_CUSTOMER = 3
 
 
-df = pd.read_csv(EXCEL_FILE)
+CSV_COLUMNS = {"Latitide", "Longitude", "Customer Name", "City", "Order Value"}
+
+df = pd.read_csv(
+    EXCEL_FILE,
+    usecols=lambda col: col in CSV_COLUMNS,
+    dtype={"Customer Name": "string", "City": "string"},
+    engine="c",
+)
 
 print("CSV columns:", df.columns.tolist())
 print("First few rows:")
@@ -21,24 +47,14 @@ longitude_col = "Longitude"
 latitude_col = "Latitide"
 
 
-def is_valid_coordinate(lat, lon):
-    try:
-        lat_val = float(lat)
-        lon_val = float(lon)
-        if -90 <= lat_val <= 90 and -180 <= lon_val <= 180:
-
-            if 12.5 <= lat_val <= 13.5 and 77.0 <= lon_val <= 78.0:
-                return True
-            elif lat_val == 25.42357674:
-                print(f"Filtering out distant location: {lat_val}, {lon_val}")
-                return False
-    except (ValueError, TypeError):
-        pass
-    return False
-
-
 print(f"Original data shape: {df.shape}")
-valid_coords_mask = df.apply(lambda row: is_valid_coordinate(row[latitude_col], row[longitude_col]), axis=1)
+lat_numeric = pd.to_numeric(df[latitude_col], errors="coerce")
+lon_numeric = pd.to_numeric(df[longitude_col], errors="coerce")
+valid_coords_mask = (
+    lat_numeric.between(12.5, 13.5)
+    & lon_numeric.between(77.0, 78.0)
+    & (lat_numeric != 25.42357674)
+)
 df_valid = df[valid_coords_mask].copy()
 print(f"After filtering invalid/distant coordinates: {df_valid.shape}")
 
@@ -49,49 +65,152 @@ if len(invalid_rows) > 0:
         print(f"  Row {idx}: {row[latitude_col]}, {row[longitude_col]} - {row.get('City', 'Unknown')}")
 
 depot_coords = f"{DEPOT[0]},{DEPOT[1]}"
-customer_locations = df_valid.apply(lambda row: f"{row[longitude_col]},{row[latitude_col]}", axis=1).tolist()
+lons = df_valid[longitude_col].to_numpy()
+lats = df_valid[latitude_col].to_numpy()
+customer_locations = [f"{lon},{lat}" for lon, lat in zip(lons, lats)]
 locations = [depot_coords] + customer_locations
 
 df = df_valid
 
+customer_names = df.get("Customer Name", pd.Series(
+    [f"Customer {i + 1}" for i in range(len(df))])).tolist()
+customer_cities = df.get("City", pd.Series(["Unknown"] * len(df))).tolist()
+customer_order_values = df.get("Order Value", pd.Series(["N/A"] * len(df))).tolist()
+
 print(f"Total locations: {len(locations)}")
 print(f"First few locations: {locations[:3]}")
 
 
-def get_distance_matrix(locations):
-    base_url = "http://localhost:5001/table/v1/driving/"
-    coords = ";".join(locations)
-    url = f"{base_url}{coords}?annotations=distance"
+TILE_SIZE = 100
+MAX_WORKERS = 8
+
+_SESSION = requests.Session()
+_SESSION.headers.update({"Accept-Encoding": "gzip"})
+_SESSION.mount("http://", HTTPAdapter(pool_connections=MAX_WORKERS,
+                                      pool_maxsize=MAX_WORKERS))
+
+
+def tile_url(base_url, coords, i0, i1, j0, j1):
+    sources = ";".join(str(i) for i in range(i0, i1))
+    destinations = ";".join(str(j) for j in range(j0, j1))
+    return (f"{base_url}{coords}?annotations=distance"
+            f"&sources={sources}&destinations={destinations}")
 
-    print(f"OSRM URL length: {len(url)} characters")
 
-    r = requests.get(url)
+def fetch_tile(session, base_url, coords, i0, i1, j0, j1):
+    url = tile_url(base_url, coords, i0, i1, j0, j1)
+
+    r = session.get(url, timeout=(3, 60))
     if r.status_code != 200:
         print(f"HTTP Status: {r.status_code}")
         print(f"Response: {r.text}")
         raise Exception(f"OSRM error: {r.text}")
 
-    response_data = r.json()
+    response_data = json_loads(r.content)
     if "distances" not in response_data:
         raise Exception(f"No distances in response: {response_data}")
 
-    return response_data["distances"]
+    return i0, i1, j0, j1, np.asarray(response_data["distances"], dtype=np.float32)
+
+
+async def fetch_tiles_async(base_url, coords, tiles, matrix):
+    semaphore = asyncio.Semaphore(MAX_WORKERS)
+
+    async def fetch(session, i0, i1, j0, j1):
+        url = tile_url(base_url, coords, i0, i1, j0, j1)
+        async with semaphore:
+            async with session.get(url) as r:
+                body = await r.read()
+                if r.status != 200:
+                    raise Exception(f"OSRM error: {body}")
+
+        response_data = json_loads(body)
+        if "distances" not in response_data:
+            raise Exception(f"No distances in response: {response_data}")
+
+        matrix[i0:i1, j0:j1] = np.asarray(response_data["distances"], dtype=np.float32)
+
+    timeout = aiohttp.ClientTimeout(connect=3, total=120)
+    headers = {"Accept-Encoding": "gzip"}
+    async with aiohttp.ClientSession(timeout=timeout, headers=headers) as session:
+        await asyncio.gather(*(fetch(session, *tile) for tile in tiles))
+
+
+def get_distance_matrix(locations):
+    coords = ";".join(locations)
+    n = len(locations)
+
+    matrix = np.empty((n, n), dtype=np.float32)
+    tiles = [(i0, min(i0 + TILE_SIZE, n), j0, min(j0 + TILE_SIZE, n))
+             for i0 in range(0, n, TILE_SIZE)
+             for j0 in range(0, n, TILE_SIZE)]
+
+    print(f"Fetching {n}x{n} distance matrix as {len(tiles)} tiles of up to {TILE_SIZE}x{TILE_SIZE}")
+
+    if aiohttp is not None:
+        asyncio.run(fetch_tiles_async(OSRM_URL, coords, tiles, matrix))
+    else:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = [executor.submit(fetch_tile, _SESSION, OSRM_URL, coords, *tile)
+                       for tile in tiles]
+            for future in futures:
+                i0, i1, j0, j1, distances = future.result()
+                matrix[i0:i1, j0:j1] = distances
+
+    return matrix
+
+
+EARTH_RADIUS_M = 6371000
+
+
+def haversine_matrix(locations):
+    """Straight-line distance matrix in meters, fully vectorized in NumPy."""
+    coords = np.array([loc.split(",") for loc in locations], dtype=np.float64)
+    lon = np.radians(coords[:, 0])
+    lat = np.radians(coords[:, 1])
+    dlat = lat[:, None] - lat[None, :]
+    dlon = lon[:, None] - lon[None, :]
+    a = (np.sin(dlat / 2) ** 2
+         + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlon / 2) ** 2)
+    return (2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))).astype(np.float32)
 
 
 try:
     distance_matrix = get_distance_matrix(locations)
-    print(f"Distance matrix size: {len(distance_matrix)}x{len(distance_matrix[0])}")
+    print(f"Distance matrix size: {distance_matrix.shape[0]}x{distance_matrix.shape[1]}")
 except Exception as e:
     print(f"Error getting distance matrix: {e}")
-    exit(1)
+    print("Falling back to straight-line haversine distances")
+    distance_matrix = haversine_matrix(locations)
+
+
+def add_reload_nodes(matrix, num_reloads):
+    """Append copies of the depot row/column so the solver can reload mid-route."""
+    n = len(matrix)
+    ext = np.empty((n + num_reloads, n + num_reloads), dtype=matrix.dtype)
+    ext[:n, :n] = matrix
+    ext[n:, :n] = matrix[0, :]
+    ext[:n, n:] = matrix[:, 0:1]
+    ext[n:, n:] = matrix[0, 0]
+    return ext
 
 
 def create_data_model():
     data = {}
-    data["distance_matrix"] = distance_matrix
+    num_locations = len(distance_matrix)
+    total_demand = DEMAND_PER_CUSTOMER * (num_locations - 1)
+    num_reloads = -(-total_demand // VEHICLE_CAPACITY)
+    data["distance_matrix"] = add_reload_nodes(distance_matrix, num_reloads)
     data["num_vehicles"] = NUM_VEHICLES
     data["depot"] = 0
-    data["demands"] = [0] + [DEMAND_PER_CUSTOMER] * (len(distance_matrix) - 1)
+    demands = np.full(num_locations + num_reloads, DEMAND_PER_CUSTOMER, dtype=np.int64)
+    demands[0] = 0
+    demands[num_locations:] = -VEHICLE_CAPACITY
+    data["demands"] = demands.tolist()
+    data["reload_nodes"] = list(range(num_locations, num_locations + num_reloads))
+    reload_mask = np.zeros(num_locations + num_reloads, dtype=bool)
+    reload_mask[num_locations:] = True
+    data["reload_mask"] = reload_mask
     data["vehicle_capacities"] = [VEHICLE_CAPACITY] * NUM_VEHICLES
     return data
 
@@ -103,181 +222,169 @@ manager = pywrapcp.RoutingIndexManager(len(data["distance_matrix"]),
 routing = pywrapcp.RoutingModel(manager)
 
 
-def distance_callback(from_index, to_index):
-    from_node = manager.IndexToNode(from_index)
-    to_node = manager.IndexToNode(to_index)
-    return int(data["distance_matrix"][from_node][to_node])
-
-
-transit_callback_index = routing.RegisterTransitCallback(distance_callback)
+dist_int = np.rint(data["distance_matrix"]).astype(np.int64)
+if dist_int.max() < np.iinfo(np.int32).max:
+    dist_int = dist_int.astype(np.int32)
+dist_int = np.ascontiguousarray(dist_int)
+transit_callback_index = routing.RegisterTransitMatrix(dist_int.tolist())
 routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
 
-
-def demand_callback(from_index):
-    from_node = manager.IndexToNode(from_index)
-    return data["demands"][from_node]
-
-
-demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
+demand_callback_index = routing.RegisterUnaryTransitVector(data["demands"])
 routing.AddDimensionWithVehicleCapacity(
     demand_callback_index,
-    0,
+    VEHICLE_CAPACITY,
     data["vehicle_capacities"],
     True,
     "Capacity"
 )
 
+capacity_dimension = routing.GetDimensionOrDie("Capacity")
+for node in range(1, len(data["distance_matrix"])):
+    index = manager.NodeToIndex(node)
+    if data["reload_mask"][node]:
+        routing.AddDisjunction([index], 0)
+    else:
+        capacity_dimension.SlackVar(index).SetValue(0)
+for vehicle_id in range(data["num_vehicles"]):
+    capacity_dimension.SlackVar(routing.Start(vehicle_id)).SetValue(0)
+
 search_parameters = pywrapcp.DefaultRoutingSearchParameters()
 search_parameters.first_solution_strategy = (
-    routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
+    routing_enums_pb2.FirstSolutionStrategy.PARALLEL_CHEAPEST_INSERTION
 )
 search_parameters.local_search_metaheuristic = (
     routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
 )
+search_parameters.local_search_operators.use_cross_exchange = BOOL_TRUE
+search_parameters.local_search_operators.use_relocate_neighbors = BOOL_TRUE
+search_parameters.local_search_operators.use_or_opt = BOOL_TRUE
+search_parameters.use_full_propagation = False
 search_parameters.time_limit.seconds = 60
-search_parameters.log_search = True
-
-total_demand = sum(data["demands"])
-total_capacity = sum(data["vehicle_capacities"])
-print(f"Total demand: {total_demand}")
-print(f"Total capacity: {total_capacity}")
-if total_demand > total_capacity:
-    print("WARNING: Total demand exceeds total capacity!")
-    print("Some customers may not be served in this single-trip solution")
-print("Starting optimization...")
-solution = routing.SolveWithParameters(search_parameters)
-
-
-def simulate_multi_trip_delivery(data, manager, routing, solution):
-    all_customers = set(range(1, len(data["distance_matrix"])))
-    served_customers = set()
-    round_number = 1
+search_parameters.log_search = bool(os.environ.get("VRP_LOG"))
 
-    print(f"\n=== MULTI-TRIP DELIVERY SIMULATION ===")
-    print(f"Total customers to serve: {len(all_customers)}")
 
-    while served_customers != all_customers:
-        print(f"\n--- ROUND {round_number} ---")
-        remaining_customers = all_customers - served_customers
-        print(f"Customers remaining: {len(remaining_customers)}")
+def nearest_neighbor_routes(data, dist):
+    """Greedy capacity-aware nearest-neighbor routes used to warm-start the solver."""
+    demands = np.asarray(data["demands"])
+    first_reload = data["reload_nodes"][0] if data["reload_nodes"] else len(demands)
+    unserved = np.zeros(len(demands), dtype=bool)
+    unserved[1:first_reload] = True
+    reload_pool = list(data["reload_nodes"])
 
-        round_served = set()
-        total_round_distance = 0
+    routes = [[] for _ in range(data["num_vehicles"])]
+    loads = [0] * data["num_vehicles"]
+    positions = [0] * data["num_vehicles"]
 
+    while unserved.any():
+        progressed = False
         for vehicle_id in range(data["num_vehicles"]):
-            if not remaining_customers:
+            candidates = np.flatnonzero(unserved)
+            if len(candidates) == 0:
                 break
-
-            index = routing.Start(vehicle_id)
-            plan_output = f"\nVehicle {vehicle_id + 1} - Round {round_number}:\n"
-            route_distance = 0
-            route_load = 0
-            stops_count = 0
-
-            plan_output += f"  → Start from DEPOT\n"
-
-            while not routing.IsEnd(index):
-                node_index = manager.IndexToNode(index)
-
-                if node_index != 0:
-                    if node_index in remaining_customers and route_load + data["demands"][
-                        node_index] <= VEHICLE_CAPACITY:
-                        stops_count += 1
-                        route_load += data["demands"][node_index]
-                        round_served.add(node_index)
-
-                        customer_idx = node_index - 1
-                        if customer_idx < len(df):
-                            customer_name = df.iloc[customer_idx].get('Customer Name', f'Customer {customer_idx + 1}')
-                            city = df.iloc[customer_idx].get('City', 'Unknown')
-                            order_value = df.iloc[customer_idx].get('Order Value', 'N/A')
-                            plan_output += f"  → Stop {stops_count}: {customer_name} ({city}) - Order: ₹{order_value}\n"
-                        else:
-                            plan_output += f"  → Stop {stops_count}: Customer {customer_idx + 1}\n"
-
-                previous_index = index
-                index = solution.Value(routing.NextVar(index))
-                if not routing.IsEnd(index):
-                    route_distance += routing.GetArcCostForVehicle(previous_index, index, vehicle_id)
-
-            if stops_count > 0:
-                plan_output += f"  → Return to DEPOT\n"
-                plan_output += f"  Distance: {route_distance / 1000:.2f} km, Stops: {stops_count}, Load: {route_load}\n"
-                print(plan_output)
-                total_round_distance += route_distance
-
-        served_customers.update(round_served)
-        print(f"Round {round_number} summary:")
-        print(f"  Customers served this round: {len(round_served)}")
-        print(f"  Total customers served: {len(served_customers)}")
-        print(f"  Round distance: {total_round_distance / 1000:.2f} km")
-
-        if not round_served:
-            print("WARNING: Could not serve any more customers. Check capacity constraints.")
+            feasible = candidates[loads[vehicle_id] + demands[candidates] <= VEHICLE_CAPACITY]
+            if len(feasible) == 0:
+                if reload_pool:
+                    node = reload_pool.pop()
+                    routes[vehicle_id].append(node)
+                    loads[vehicle_id] = 0
+                    positions[vehicle_id] = 0
+                    progressed = True
+                continue
+            nearest = int(feasible[np.argmin(dist[positions[vehicle_id], feasible])])
+            routes[vehicle_id].append(nearest)
+            loads[vehicle_id] += int(demands[nearest])
+            positions[vehicle_id] = nearest
+            unserved[nearest] = False
+            progressed = True
+        if not progressed:
             break
 
-        round_number += 1
+    return routes
+
+
+total_demand = sum(d for d in data["demands"] if d > 0)
+total_capacity = sum(data["vehicle_capacities"])
+print(f"Total demand: {total_demand}")
+print(f"Fleet capacity per trip: {total_capacity}")
+print(f"Reload stops available: {len(data['reload_nodes'])}")
+print("Starting optimization...")
+routing.CloseModelWithParameters(search_parameters)
+initial_solution = routing.ReadAssignmentFromRoutes(
+    nearest_neighbor_routes(data, dist_int), True)
+if initial_solution:
+    solution = routing.SolveFromAssignmentWithParameters(initial_solution, search_parameters)
+else:
+    print("Warm start infeasible, solving from scratch")
+    solution = routing.SolveWithParameters(search_parameters)
+
 
-    print(f"\n=== FINAL SUMMARY ===")
-    print(f"Total rounds needed: {round_number - 1}")
-    print(f"Customers served: {len(served_customers)} out of {len(all_customers)}")
-    if served_customers != all_customers:
-        unserved = all_customers - served_customers
-        print(f"Unserved customers: {list(unserved)}")
+def extract_routes(routing, manager, solution, num_vehicles):
+    """Walk each vehicle's route once and return it as a list of node indices."""
+    routes = []
+    for vehicle_id in range(num_vehicles):
+        index = routing.Start(vehicle_id)
+        route = []
+        while not routing.IsEnd(index):
+            route.append(manager.IndexToNode(index))
+            index = solution.Value(routing.NextVar(index))
+        route.append(manager.IndexToNode(index))
+        routes.append(route)
+    return routes
 
 
-def print_solution(data, manager, routing, solution):
-    """Print the single-trip solution first"""
-    print(f"\n=== SINGLE-TRIP SOLUTION (for reference) ===")
+def print_solution(data, routes):
+    """Print the multi-trip solution, with reload stops shown as depot visits."""
+    print(f"\n=== MULTI-TRIP SOLUTION ===")
+    reloads = data["reload_mask"]
     total_distance = 0
     total_load = 0
 
-    for vehicle_id in range(data["num_vehicles"]):
-        index = routing.Start(vehicle_id)
-        plan_output = f"Route for Vehicle {vehicle_id + 1}:\n"
+    for vehicle_id, route in enumerate(routes):
+        plan_parts = [f"Route for Vehicle {vehicle_id + 1}:\n"]
         route_distance = 0
         route_load = 0
+        route_served = 0
         stops_count = 0
 
-        while not routing.IsEnd(index):
-            node_index = manager.IndexToNode(index)
-            route_load += data["demands"][node_index]
-
+        for pos, node_index in enumerate(route[:-1]):
             if node_index == 0:
                 location_info = f"DEPOT"
+            elif reloads[node_index]:
+                route_load = 0
+                location_info = f"RELOAD (DEPOT)"
             else:
+                route_load += data["demands"][node_index]
+                route_served += data["demands"][node_index]
                 stops_count += 1
                 customer_idx = node_index - 1
                 if customer_idx < len(df):
-                    customer_info = df.iloc[customer_idx].get('Customer Name', f'Customer {customer_idx + 1}')
-                    city = df.iloc[customer_idx].get('City', 'Unknown')
-                    location_info = f"{customer_info} ({city})"
+                    customer_info = customer_names[customer_idx]
+                    city = customer_cities[customer_idx]
+                    order_value = customer_order_values[customer_idx]
+                    location_info = f"{customer_info} ({city}) - Order: ₹{order_value}"
                 else:
                     location_info = f"Customer {customer_idx + 1}"
 
-            plan_output += f" → {location_info} (Load: {route_load}) "
+            plan_parts.append(f" → {location_info} (Load: {route_load}) ")
 
-            previous_index = index
-            index = solution.Value(routing.NextVar(index))
-            route_distance += routing.GetArcCostForVehicle(previous_index, index, vehicle_id)
+            route_distance += int(dist_int[node_index][route[pos + 1]])
 
-        plan_output += f" → DEPOT\n"
-        plan_output += f"Distance: {route_distance / 1000:.2f} km, Stops: {stops_count}\n"
+        plan_parts.append(" → DEPOT\n")
+        plan_parts.append(f"Distance: {route_distance / 1000:.2f} km, Stops: {stops_count}\n")
 
         if stops_count > 0:
-            print(plan_output)
+            print("".join(plan_parts))
 
         total_distance += route_distance
-        total_load += route_load
+        total_load += route_served
 
     print(f"Total distance: {total_distance / 1000:.2f} km")
     print(f"Total load: {total_load}")
 
-    simulate_multi_trip_delivery(data, manager, routing, solution)
-
 
 if solution:
-    print_solution(data, manager, routing, solution)
+    routes = extract_routes(routing, manager, solution, data["num_vehicles"])
+    print_solution(data, routes)
 else:
     print("No solution found!")
 
@@ -285,4 +392,4 @@ else:
     print(f"Number of locations: {len(locations)}")
     print(f"Number of vehicles: {NUM_VEHICLES}")
     print(f"Vehicle capacity: {VEHICLE_CAPACITY}")
-    print(f"Total demand: {sum(data['demands'])}")
\ No newline at end of file
+    print(f"Total demand: {total_demand}")
\ No newline at end of file